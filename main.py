@@ -1,8 +1,27 @@
+# ruff: noqa: E402
+import time
+
+# Inicio del proceso, para que el perfil y el "primer update" incluyan las importaciones
+_T0 = time.perf_counter()
+
 import os
+import re
+import hmac
 import json
+import hashlib
+import shutil
+import asyncio
+import sys
 import logging
 import datetime
-from dotenv import load_dotenv
+import zlib
+import mimetypes
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from functools import wraps
 from telegram import (
     Update,
@@ -11,12 +30,14 @@ from telegram import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
+from telegram.error import TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -29,20 +50,33 @@ ASK_AFTER_EDIT_OPTION = 104
 INFO_NAME, INFO_LASTNAME, INFO_BIRTHDATE, INFO_CERTIFICATES = range(4)
 
 # --- Configuración ---
-load_dotenv()
 ALLOWED_USERS = {
     885850042,  # mvaled
     1615047788,  # elmulas
     811614523,  # Yadenisp
 }
-TOKEN = os.getenv("TELEGRAM_TOKEN")
 DATA_FILE = "viajes_data.json"
+META_FILE = "files_meta.json"
 FILES_DIR = "files"
-
-if not os.path.exists(FILES_DIR):
-    os.makedirs(FILES_DIR)
-
-logging.basicConfig(level=logging.INFO)
+THUMBS_DIR = os.path.join(FILES_DIR, ".thumbs")
+THUMB_SIZE = 128
+
+# Se rellenan en load_config(), para que importar el módulo no tenga efectos
+TOKEN = None
+CALENDAR_HOST = None
+CALENDAR_PORT = None
+CALENDAR_BASE_URL = None
+
+def load_config():
+    global TOKEN, CALENDAR_HOST, CALENDAR_PORT, CALENDAR_BASE_URL
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    TOKEN = os.getenv("TELEGRAM_TOKEN")
+    CALENDAR_HOST = os.getenv("CALENDAR_HOST", "127.0.0.1")
+    CALENDAR_PORT = int(os.getenv("CALENDAR_PORT", "8080"))
+    CALENDAR_BASE_URL = os.getenv("CALENDAR_BASE_URL", f"http://localhost:{CALENDAR_PORT}")
 
 def load_data(user_id=None):
     if os.path.exists(DATA_FILE):
@@ -58,6 +92,488 @@ def save_data(user_id, data):
     all_data[str(user_id)] = data  # Update with the specific user's data
     with open(DATA_FILE, "w") as f:
         json.dump(all_data, f, indent=2)
+    calendar_feeds.invalidate(user_id)
+
+# --- Post-procesamiento de documentos ---
+PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+PDF_PAGES_RE = re.compile(rb"/Type\s*/Pages(?![a-zA-Z])")
+PDF_COUNT_RE = re.compile(rb"/Count\s+(\d+)")
+PDF_STREAM_RE = re.compile(rb"(?<!end)stream\r?\n(.*?)endstream", re.S)
+PDF_DICT_TOKEN_RE = re.compile(rb"<<|>>")
+PDF_MAX_OBJSTM = 16 * 1024 * 1024
+STATS_WINDOW = 300
+
+def pdf_object_text(content):
+    """Cuerpo del PDF sin streams, más las object streams (/ObjStm) descomprimidas.
+
+    Desde PDF 1.5 los diccionarios /Pages y /Page suelen ir dentro de object
+    streams comprimidas, invisibles en los bytes en bruto.
+    """
+    parts = [PDF_STREAM_RE.sub(b"stream endstream", content)]
+    for match in PDF_STREAM_RE.finditer(content):
+        header = content[max(0, match.start() - 1024):match.start()]
+        header = header[header.rfind(b"obj"):]
+        if b"/ObjStm" not in header or b"/FlateDecode" not in header:
+            continue
+        try:
+            parts.append(zlib.decompressobj().decompress(match.group(1), PDF_MAX_OBJSTM))
+        except zlib.error:
+            continue
+    return b"\n".join(parts)
+
+def pdf_page_count(content):
+    """Número de páginas según el árbol /Pages, o None si no se encuentra."""
+    text = pdf_object_text(content)
+    counts = []
+    # Se recorren los diccionarios con una pila para leer /Type y /Count del
+    # mismo nivel, sin confundirlos con los de diccionarios anidados.
+    stack = []
+    for token in PDF_DICT_TOKEN_RE.finditer(text):
+        if token.group() == b"<<":
+            stack.append((token.start(), []))
+            continue
+        if not stack:
+            continue
+        start, children = stack.pop()
+        flat, cursor = [], start + 2
+        for child_start, child_end in children:
+            flat.append(text[cursor:child_start])
+            cursor = child_end
+        flat.append(text[cursor:token.start()])
+        flat = b" ".join(flat)
+        if PDF_PAGES_RE.search(flat) and (count := PDF_COUNT_RE.search(flat)):
+            counts.append(int(count.group(1)))
+        if stack:
+            stack[-1][1].append((start, token.end()))
+
+    if counts:
+        # El /Count del nodo raíz es el mayor del árbol
+        return max(counts)
+    return len(PDF_PAGE_RE.findall(text)) or None
+
+def extract_file_metadata(file_path):
+    """Extrae tamaño, tipo MIME, páginas y miniatura de un archivo.
+
+    Se ejecuta en un proceso del pool, así que no debe tocar el estado
+    del bot: solo lee el archivo y devuelve un diccionario.
+    """
+    stat = os.stat(file_path)
+    mime_type, _ = mimetypes.guess_type(file_path)
+    meta = {
+        "size": stat.st_size,
+        "mime_type": mime_type or "application/octet-stream",
+        "pages": None,
+        "thumbnail": None,
+        "mtime": stat.st_mtime,
+    }
+
+    thumb_base = os.path.join(THUMBS_DIR, hashlib.sha1(file_path.encode("utf-8")).hexdigest())
+
+    if meta["mime_type"] == "application/pdf":
+        with open(file_path, "rb") as f:
+            meta["pages"] = pdf_page_count(f.read())
+
+        if shutil.which("pdftoppm"):
+            try:
+                result = subprocess.run(
+                    ["pdftoppm", "-png", "-singlefile", "-f", "1", "-l", "1",
+                     "-scale-to", str(THUMB_SIZE), file_path, thumb_base],
+                    capture_output=True,
+                    timeout=60,
+                )
+                if result.returncode == 0:
+                    meta["thumbnail"] = thumb_base + ".png"
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.warning(f"No se pudo generar la miniatura de '{file_path}': {e}")
+    elif meta["mime_type"].startswith("image/"):
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+        if Image is not None:
+            # Pillow lanza errores muy variados (UnidentifiedImageError,
+            # DecompressionBombError...); la miniatura es opcional.
+            try:
+                with Image.open(file_path) as img:
+                    img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+                    img.convert("RGB").save(thumb_base + ".png")
+                meta["thumbnail"] = thumb_base + ".png"
+            except Exception as e:
+                logging.warning(f"No se pudo generar la miniatura de '{file_path}': {e}")
+
+    return meta
+
+def timed_extract_file_metadata(file_path):
+    """Como extract_file_metadata, pero devuelve (metadatos, segundos, error).
+
+    El tiempo se mide dentro del proceso del pool, sin contar la espera en cola.
+    """
+    started = time.perf_counter()
+    try:
+        return extract_file_metadata(file_path), time.perf_counter() - started, None
+    except Exception as e:
+        return None, time.perf_counter() - started, str(e)
+
+def failed_file_metadata(file_path, error):
+    """Registro para un archivo que no se pudo procesar, con lo que se sepa de él."""
+    meta = {"error": str(error)}
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return meta
+    mime_type, _ = mimetypes.guess_type(file_path)
+    meta.update(
+        size=stat.st_size,
+        mime_type=mime_type or "application/octet-stream",
+        mtime=stat.st_mtime,
+    )
+    return meta
+
+class DocumentPipeline:
+    """Procesa documentos descargados en un pool de procesos.
+
+    Los resultados se guardan en META_FILE desde el hilo del event loop,
+    por lo que nunca hay escrituras concurrentes sobre el archivo.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._meta = None
+        self._tasks = {}
+        self.processed = 0
+        self.failed = 0
+        # (instante, segundos de trabajo) de cada archivo terminado en los últimos STATS_WINDOW s
+        self._recent = deque()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            os.makedirs(THUMBS_DIR, exist_ok=True)
+            # "spawn" en vez de fork: el proceso ya tiene hilos (httpx, asyncio.to_thread)
+            # y hacer fork con hilos puede bloquear a los hijos.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = {}
+            if os.path.exists(META_FILE):
+                try:
+                    with open(META_FILE, "r") as f:
+                        self._meta = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Es una caché derivada: warm_caches la reconstruye
+                    logging.warning(f"Se ignora {META_FILE} dañado: {e}")
+        return self._meta
+
+    def get(self, file_path):
+        return self.meta.get(file_path)
+
+    def _save(self):
+        tmp_file = META_FILE + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_file, META_FILE)
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    def submit(self, file_path):
+        """Encola un archivo; devuelve la tarea asyncio que lo procesa.
+
+        El event loop solo guarda una referencia débil a la tarea, así que
+        se mantiene en self._tasks hasta que termina.
+        """
+        if file_path in self._tasks:
+            return self._tasks[file_path]
+        task = asyncio.get_running_loop().create_task(self._process(file_path))
+        self._tasks[file_path] = task
+        task.add_done_callback(lambda _: self._tasks.pop(file_path, None))
+        return task
+
+    def stale_paths(self, paths):
+        """Rutas sin metadatos, con error o cuyo archivo cambió desde que se procesaron."""
+        stale = []
+        for file_path in paths:
+            meta = self.get(file_path)
+            if meta is None:
+                stale.append(file_path)
+                continue
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except OSError:
+                continue
+            # Los errores se reintentan: pueden venir del pool y no del archivo
+            if "error" in meta or meta.get("mtime") != mtime:
+                stale.append(file_path)
+        return stale
+
+    async def _process(self, file_path):
+        loop = asyncio.get_running_loop()
+        try:
+            meta, seconds, error = await loop.run_in_executor(
+                self.executor, timed_extract_file_metadata, file_path
+            )
+        except Exception as e:
+            # Fallo del propio pool (proceso caído, error al serializar...)
+            meta, seconds, error = None, None, str(e)
+            if isinstance(e, BrokenProcessPool) and self._executor is not None:
+                # Un pool roto rechaza todo lo que se le envíe; se crea otro
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+        if error is None:
+            self.processed += 1
+        else:
+            self.failed += 1
+            logging.error(f"No se pudo procesar '{file_path}': {error}")
+            meta = failed_file_metadata(file_path, error)
+        if seconds is not None:
+            self._recent.append((time.monotonic(), seconds))
+
+        self.meta[file_path] = meta
+        self._save()
+        return meta
+
+    def stats(self):
+        """Contadores totales; ritmo y tiempo medio solo de los últimos STATS_WINDOW s."""
+        cutoff = time.monotonic() - STATS_WINDOW
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        recent = len(self._recent)
+        return {
+            "pending": self.pending,
+            "processed": self.processed,
+            "failed": self.failed,
+            "per_minute": recent * 60 / STATS_WINDOW,
+            "avg_seconds": sum(seconds for _, seconds in self._recent) / recent if recent else None,
+        }
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+pipeline = DocumentPipeline()
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def summarize_files(files):
+    """Resume una lista de rutas usando solo los metadatos ya calculados."""
+    total_size = 0
+    total_pages = 0
+    pending = 0
+    failed = 0
+    for file_path in files:
+        meta = pipeline.get(file_path)
+        if meta is None:
+            pending += 1
+            continue
+        if "error" in meta:
+            failed += 1
+        total_size += meta.get("size", 0)
+        total_pages += meta.get("pages") or 0
+
+    summary = f"{len(files)} archivo(s)"
+    if total_size:
+        summary += f", {format_size(total_size)}"
+    if total_pages:
+        summary += f", {total_pages} pág."
+    if pending:
+        summary += f", {pending} en proceso"
+    if failed:
+        summary += f", {failed} con error"
+    return summary
+
+# --- Calendario ICS ---
+def ics_escape(text):
+    return (
+        str(text)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+def ics_fold(line):
+    """Parte una línea en trozos de 75 octetos, como pide RFC 5545."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # No cortar en medio de un carácter UTF-8
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    return "\r\n ".join(parts)
+
+def trip_to_vevent(user_id, trip_name, info, dtstamp):
+    start = datetime.datetime.strptime(info["start_date"], "%Y-%m-%d").date()
+    end = datetime.datetime.strptime(info.get("end_date") or info["start_date"], "%Y-%m-%d").date()
+    if end < start:
+        # /edittrip no comprueba el orden; un DTEND anterior a DTSTART invalida el calendario
+        raise ValueError(f"la fecha final {end} es anterior a la de inicio {start}")
+    uid = hashlib.sha1(f"{user_id}:{trip_name}".encode("utf-8")).hexdigest()
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}@viajante",
+        f"DTSTAMP:{dtstamp}",
+        f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+        # DTEND es exclusivo en eventos de día completo
+        f"DTEND;VALUE=DATE:{end + datetime.timedelta(days=1):%Y%m%d}",
+        f"SUMMARY:{ics_escape(trip_name)}",
+    ]
+    if info.get("destination"):
+        lines.append(f"LOCATION:{ics_escape(info['destination'])}")
+    lines.append("END:VEVENT")
+    return "\r\n".join(ics_fold(line) for line in lines) + "\r\n"
+
+class CalendarFeedCache:
+    """Feeds ICS por usuario, regenerados solo cuando cambian sus viajes.
+
+    Cada VEVENT se guarda junto con los campos de los que depende, así que
+    al regenerar un feed solo se vuelven a renderizar los viajes modificados.
+    """
+
+    def __init__(self):
+        self._feeds = {}
+        self._events = {}
+
+    def invalidate(self, user_id):
+        self._feeds.pop(str(user_id), None)
+
+    def get(self, user_id):
+        """Devuelve (etag, cuerpo) del feed; solo llama a load_data si está invalidado."""
+        user_id = str(user_id)
+        if user_id not in self._feeds:
+            self._feeds[user_id] = self._build(user_id)
+        return self._feeds[user_id]
+
+    def _build(self, user_id):
+        data = load_data(user_id)
+        old_events = self._events.get(user_id, {})
+        events = {}
+        dtstamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        for trip_name, info in data.items():
+            if not isinstance(info, dict) or not info.get("start_date"):
+                continue
+            key = (info["start_date"], info.get("end_date"), info.get("destination"))
+            cached = old_events.get(trip_name)
+            if cached is not None and cached[0] == key:
+                events[trip_name] = cached
+                continue
+            try:
+                events[trip_name] = (key, trip_to_vevent(user_id, trip_name, info, dtstamp))
+            except ValueError as e:
+                logging.warning(f"Fechas inválidas en el viaje '{trip_name}' ({e}), se omite del calendario.")
+        self._events[user_id] = events
+
+        body = (
+            "BEGIN:VCALENDAR\r\n"
+            "VERSION:2.0\r\n"
+            "PRODID:-//viajante//ES\r\n"
+            "CALSCALE:GREGORIAN\r\n"
+            "X-WR-CALNAME:Viajes\r\n"
+            + "".join(vevent for _, vevent in events.values())
+            + "END:VCALENDAR\r\n"
+        ).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return etag, body
+
+calendar_feeds = CalendarFeedCache()
+
+def calendar_signature(user_id):
+    return hmac.new((TOKEN or "").encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:32]
+
+def calendar_url(user_id):
+    return f"{CALENDAR_BASE_URL}/calendar/{user_id}/{calendar_signature(user_id)}.ics"
+
+CALENDAR_PATH_RE = re.compile(r"^/calendar/(\d+)/([0-9a-f]+)\.ics$")
+
+def etag_matches(if_none_match, etag):
+    """Comparación débil de If-None-Match (RFC 9110, sección 13.1.2)."""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags
+
+async def calendar_response(reader):
+    """Lee una petición HTTP y devuelve (estado, cabeceras, cuerpo)."""
+    status, headers, body = "404 Not Found", {}, b""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        request_headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            request_headers[name.strip().lower()] = value.strip()
+
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except (ValueError, asyncio.TimeoutError):
+        return "400 Bad Request", headers, body
+
+    match = CALENDAR_PATH_RE.match(path.split("?", 1)[0])
+    if method not in ("GET", "HEAD"):
+        status = "405 Method Not Allowed"
+        headers["Allow"] = "GET, HEAD"
+    elif match and int(match.group(1)) in ALLOWED_USERS and hmac.compare_digest(
+        match.group(2), calendar_signature(match.group(1))
+    ):
+        etag, feed = calendar_feeds.get(match.group(1))
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "private, max-age=300"
+        if etag_matches(request_headers.get("if-none-match", ""), etag):
+            status = "304 Not Modified"
+        else:
+            status = "200 OK"
+            headers["Content-Type"] = "text/calendar; charset=utf-8"
+            headers["Content-Length"] = str(len(feed))
+            if method == "GET":
+                body = feed
+    return status, headers, body
+
+async def handle_calendar_request(reader, writer):
+    try:
+        status, headers, body = await calendar_response(reader)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        # El cliente cerró la conexión a mitad de la petición
+        writer.close()
+        return
+    except Exception:
+        logging.exception("Error al generar el calendario ICS")
+        status, headers, body = "500 Internal Server Error", {}, b""
+
+    if not status.startswith("304"):
+        headers.setdefault("Content-Length", str(len(body)))
+    headers["Connection"] = "close"
+    head = f"HTTP/1.1 {status}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    try:
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
 
 def restricted(func):
     @wraps(func)
@@ -100,8 +616,8 @@ async def list_trips(update: Update, context: ContextTypes.DEFAULT_TYPE):
         destination = info.get("destination", "¿Sin destino?")
         start = info.get("start_date", "¿Sin inicio?")
         end = info.get("end_date", "¿Sin fin?")
-        num_files = len(info.get("files", []))
-        reply += f"• {name}: {start} – {end} • Destino: {destination} ({num_files} archivo(s))\n"
+        files_summary = summarize_files(info.get("files", []))
+        reply += f"• {name}: {start} – {end} • Destino: {destination} ({files_summary})\n"
 
     await update.effective_message.reply_text(reply, parse_mode="Markdown")
 
@@ -127,6 +643,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file_path = os.path.join(trip_folder, document.file_name)
     file = await context.bot.get_file(document.file_id)
     await file.download_to_drive(file_path)
+    pipeline.submit(file_path)
 
     if "files" not in data[trip_name]:
         data[trip_name]["files"] = []
@@ -229,10 +746,12 @@ async def collect_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     safe_name = trip_name.replace(" ", "_")
+    os.makedirs(FILES_DIR, exist_ok=True)
     file_path = os.path.join(FILES_DIR, f"{safe_name}_{document.file_name}")
 
     file = await context.bot.get_file(document.file_id)
     await file.download_to_drive(file_path)
+    pipeline.submit(file_path)
 
     context.user_data["files"].append(file_path)
     await update.message.reply_text(
@@ -438,10 +957,12 @@ async def receive_document_edit(update: Update, context: ContextTypes.DEFAULT_TY
     trip_name, trip_info = trips_list[trip_index]
 
     safe_name = trip_name.replace(" ", "_")
+    os.makedirs(FILES_DIR, exist_ok=True)
     file_path = os.path.join(FILES_DIR, f"{safe_name}_{document.file_name}")
 
     file = await context.bot.get_file(document.file_id)
     await file.download_to_drive(file_path)
+    pipeline.submit(file_path)
 
     data = load_data(user_id)  # Ensure to get user-specific data
     if trip_name not in data:
@@ -607,8 +1128,8 @@ async def my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     birthdate = profile.get("birthdate", "No definido")
     certificates = profile.get("certificates", "Ninguno")
 
-    trips = user_data.get("trips", [])
-    documents = user_data.get("documents", [])
+    trips = {name: info for name, info in user_data.items() if name != "profile"}
+    documents = [path for info in trips.values() for path in info.get("files", [])]
 
     message = (
         f"👤 *Perfil del usuario*\n\n"
@@ -617,10 +1138,34 @@ async def my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🎂 Fecha de nacimiento: {birthdate}\n"
         f"📄 Certificados: {certificates}\n\n"
         f"🧳 Viajes guardados: {len(trips)}\n"
-        f"📁 Documentos guardados: {len(documents)}"
+        f"📁 Documentos guardados: {summarize_files(documents)}"
     )
     await update.message.reply_markdown(message)
 
+@restricted
+async def calendar_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await update.message.reply_text(
+        "📅 Suscríbete a tus viajes desde tu calendario con esta URL:\n\n"
+        f"{calendar_url(user_id)}"
+    )
+
+@restricted
+async def pipeline_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = pipeline.stats()
+    await update.message.reply_text(
+        "⚙️ Procesamiento de documentos\n\n"
+        f"⏳ En cola: {stats['pending']}\n"
+        f"✅ Procesados: {stats['processed']}\n"
+        f"❌ Fallidos: {stats['failed']}\n"
+        f"📈 Ritmo (últimos {STATS_WINDOW // 60} min): {stats['per_minute']:.1f} archivo(s)/min\n"
+        + (
+            f"⏱️ Tiempo medio por archivo: {stats['avg_seconds']:.2f} s"
+            if stats["avg_seconds"] is not None
+            else "⏱️ Tiempo medio por archivo: sin datos recientes"
+        )
+    )
+
 async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     await update.message.reply_text(
@@ -642,11 +1187,136 @@ async def set_commands(app):
             BotCommand("cancel", "Cancelar conversación"),
             BotCommand("start", "Mostrar el menú principal"),
             BotCommand("getid", "Mostrar tu ID de Telegram"),
+            BotCommand("pipelinestats", "Estado del procesamiento de documentos"),
+            BotCommand("calendar", "Enlace al calendario de tus viajes"),
         ]
     )
 
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+async def warm_caches(backfill=True):
+    """Carga metadatos y feeds en segundo plano, sin retrasar el primer update.
+
+    Con backfill, también encola los archivos de los viajes que no tienen
+    metadatos o que han cambiado, por ejemplo los subidos antes de existir el
+    pipeline. --profile-startup lo desactiva para no modificar files_meta.json.
+    """
+    pipeline.meta
+    paths = [
+        file_path
+        for user_data in load_data().values()
+        if isinstance(user_data, dict)
+        for info in user_data.values()
+        if isinstance(info, dict)
+        for file_path in info.get("files", [])
+    ]
+    stale = await asyncio.to_thread(pipeline.stale_paths, paths)
+    if backfill:
+        for file_path in stale:
+            pipeline.submit(file_path)
+    elif stale:
+        logging.info(f"{len(stale)} archivo(s) sin metadatos al día; no se procesan al perfilar.")
+    for user_id in ALLOWED_USERS:
+        await asyncio.sleep(0)
+        calendar_feeds.get(user_id)
+    logging.info("Cachés precalentadas.")
+
+async def note_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    bot_data = context.application.bot_data
+    if "first_update_after" not in bot_data:
+        bot_data["first_update_after"] = time.perf_counter() - _T0
+        logging.info(f"Primer update recibido {bot_data['first_update_after']:.2f} s tras el arranque.")
+
+async def start_calendar_server(app):
+    try:
+        app.bot_data["calendar_server"] = await asyncio.start_server(
+            handle_calendar_request, CALENDAR_HOST, CALENDAR_PORT
+        )
+    except OSError as e:
+        # El feed es opcional: el bot sigue funcionando sin él
+        logging.error(f"No se pudo iniciar el calendario ICS en {CALENDAR_HOST}:{CALENDAR_PORT}: {e}")
+        return
+    logging.info(f"Calendario ICS disponible en {CALENDAR_HOST}:{CALENDAR_PORT}")
+
+async def post_init(app):
+    await start_calendar_server(app)
+    try:
+        await set_commands(app)
+    except TelegramError as e:
+        logging.error(f"No se pudieron registrar los comandos: {e}")
+    # La aplicación aún no está en marcha (app.create_task avisaría y no la
+    # esperaría), así que la tarea se guarda aquí y se cancela en shutdown().
+    app.bot_data["warm_up"] = asyncio.get_running_loop().create_task(
+        warm_caches(backfill=not app.bot_data.get("profiling", False))
+    )
+
+async def shutdown(app):
+    warm_up = app.bot_data.pop("warm_up", None)
+    if warm_up is not None:
+        warm_up.cancel()
+        await asyncio.gather(warm_up, return_exceptions=True)
+    server = app.bot_data.pop("calendar_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await pipeline.shutdown()
+
+# --- Perfilado del arranque ---
+class StartupProfiler:
+    """Mide la duración de cada fase del arranque (--profile-startup)."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def measure_imports(self, limit=8):
+        """Importa este módulo en un intérprete nuevo con -X importtime."""
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+        children = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            seconds = int(cumulative) / 1e6
+            if name.startswith("   ") and not name.startswith("     "):
+                children.append((name.strip(), seconds))
+            elif not name.startswith("  "):
+                if name.strip() == module:
+                    children.sort(key=lambda item: item[1], reverse=True)
+                    for child, child_seconds in children[:limit]:
+                        self.phases.append((f"import {child}", child_seconds))
+                    self.phases.append((f"import {module} (total)", seconds))
+                    return
+                children = []
+
+    def report(self):
+        lines = ["⏱️ Perfil de arranque:"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<40} {seconds * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+def build_application(token):
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, note_first_update), group=-1)
 
     conv_handler_add = ConversationHandler(
         entry_points=[CommandHandler("addtrip", add_trip_start)],
@@ -707,8 +1377,52 @@ def main():
     app.add_handler(CommandHandler("infoform", start_infoform))
     app.add_handler(CommandHandler("finish", finish_infoform))
     app.add_handler(CommandHandler("myprofile", my_profile))
+    app.add_handler(CommandHandler("pipelinestats", pipeline_stats))
+    app.add_handler(CommandHandler("calendar", calendar_link))
     app.add_handler(infoform_handler)
+    return app
+
+async def profile_application(profiler, app):
+    """Reproduce lo que hace run_polling antes de empezar a recibir updates."""
+    try:
+        if TOKEN:
+            with profiler.phase("initialize (get_me)"):
+                await app.initialize()
+            with profiler.phase("post_init"):
+                await app.post_init(app)
+            profiler.phases.append(("listo para polling (desde el inicio)", time.perf_counter() - _T0))
+            warm_up = app.bot_data["warm_up"]
+        else:
+            logging.warning("Sin TELEGRAM_TOKEN no se miden initialize ni post_init.")
+            warm_up = asyncio.get_running_loop().create_task(warm_caches(backfill=False))
+        # Ya no bloquea el arranque: corre mientras el bot hace polling. Se mide
+        # sin backfill, así que no incluye el procesamiento de documentos.
+        with profiler.phase("warm_caches sin backfill (en segundo plano)"):
+            await warm_up
+    finally:
+        # shutdown() no hace nada si la aplicación no llegó a inicializarse
+        await app.shutdown()
+        await app.post_shutdown(app)
+
+def profile_startup():
+    profiler = StartupProfiler()
+    profiler.phases.append(("importaciones (este proceso)", time.perf_counter() - _T0))
+    with profiler.phase("load_config"):
+        load_config()
+    with profiler.phase("build_application"):
+        app = build_application(TOKEN or "0:profile-startup")
+    app.bot_data["profiling"] = True
+    asyncio.run(profile_application(profiler, app))
+    profiler.measure_imports()
+    print(profiler.report())
+
+def main():
+    if "--profile-startup" in sys.argv[1:]:
+        profile_startup()
+        return
 
+    load_config()
+    app = build_application(TOKEN)
     app.run_polling()
 
 if __name__ == "__main__":